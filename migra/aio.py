@@ -0,0 +1,104 @@
+from __future__ import unicode_literals
+
+import asyncio
+from contextlib import asynccontextmanager
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from schemainspect import DBInspector, get_inspector
+
+from .changes import Changes
+from .migra import Migration
+from .statements import Statements
+
+ASYNC_DRIVER = "postgresql+asyncpg"
+
+
+def async_url(url):
+    """
+    Point a plain postgresql:// url at the async driver.
+    """
+    url = make_url(url)
+    if url.drivername == "postgresql":
+        url = url.set(drivername=ASYNC_DRIVER)
+    return url
+
+
+@asynccontextmanager
+async def async_arg_context(x):
+    """
+    Like arg_context, but yielding an async connection inside a transaction.
+
+    x can be a database url, or an AsyncEngine to take a pooled connection from.
+    """
+    if x == "EMPTY":
+        yield None
+
+    elif isinstance(x, AsyncEngine):
+        async with x.begin() as c:
+            yield c
+
+    else:
+        engine = create_async_engine(async_url(x))
+        try:
+            async with engine.begin() as c:
+                yield c
+        finally:
+            await engine.dispose()
+
+
+async def get_async_inspector(c, schema=None):
+    if c is None:
+        return get_inspector(None)
+    return await c.run_sync(get_inspector, schema=schema)
+
+
+class AsyncMigration(Migration):
+    """
+    Migration for async connections. Nothing is inspected until inspect() is
+    awaited. Generating the statements is the same as for Migration.
+    """
+
+    def __init__(self, x_from, x_target, schema=None):
+        self.statements = Statements()
+        self.changes = Changes(None, None)
+        self.schema = schema
+        if isinstance(x_from, DBInspector):
+            self.changes.i_from = x_from
+            self.c_from = None
+        else:
+            self.c_from = x_from
+        if isinstance(x_target, DBInspector):
+            self.changes.i_target = x_target
+            self.c_target = None
+        else:
+            self.c_target = x_target
+
+    async def inspect(self):
+        """
+        Inspect both sides concurrently, skipping any passed in as inspectors.
+        """
+        tasks = []
+        if self.c_from is not None or self.changes.i_from is None:
+            tasks.append(self.inspect_from())
+        if self.c_target is not None or self.changes.i_target is None:
+            tasks.append(self.inspect_target())
+        await asyncio.gather(*tasks)
+
+    async def inspect_from(self):
+        self.changes.i_from = await get_async_inspector(self.c_from, self.schema)
+
+    async def inspect_target(self):
+        self.changes.i_target = await get_async_inspector(self.c_target, self.schema)
+
+    async def apply(self):
+        # statements can hold several commands, which a prepared statement can't,
+        # so they're sent to the driver directly, within the same transaction
+        raw = await self.c_from.get_raw_connection()
+        for stmt in self.statements:
+            await raw.driver_connection.execute(stmt)
+        await self.inspect_from()
+        safety_on = self.statements.safe
+        self.clear()
+        self.set_safety(safety_on)
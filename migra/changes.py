@@ -1,8 +1,11 @@
 from __future__ import unicode_literals
 
+import re
 from collections import OrderedDict as od
 from functools import partial
 
+from schemainspect.misc import quoted_identifier
+
 from .statements import Statements
 from .util import differences
 
@@ -22,6 +25,9 @@ THINGS = [
 ]
 PK = "PRIMARY KEY"
 
+# tag for statements that must appear at most once when tagged output is merged
+ONCE = (2,)
+
 
 def statements_for_changes(
     things_from,
@@ -31,6 +37,7 @@ def statements_for_changes(
     modifications=True,
     dependency_ordering=False,
     add_dependents_for_modified=False,
+    tags=None,
 ):
     added, removed, modified, unmodified = differences(things_from, things_target)
 
@@ -44,6 +51,7 @@ def statements_for_changes(
         modifications=modifications,
         dependency_ordering=dependency_ordering,
         old=things_from,
+        tags=tags,
     )
 
 
@@ -57,9 +65,17 @@ def statements_from_differences(
     modifications=True,
     dependency_ordering=False,
     old=None,
+    tags=None,
 ):
     replaceable = replaceable or set()
     statements = Statements()
+    passes = 0
+
+    def emit(statement, section, k):
+        statements.append(statement)
+        if tags is not None:
+            tags.append((passes, section, k))
+
     if not creations_only:
         pending_drops = set(removed)
         if modifications:
@@ -91,26 +107,27 @@ def statements_from_differences(
             for k, v in removed.items():
                 if not has_remaining_dependents(v, pending_drops):
                     if k in pending_drops:
-                        statements.append(old[k].drop_statement)
+                        emit(old[k].drop_statement, 0, k)
                         pending_drops.remove(k)
         if not drops_only:
             for k, v in added.items():
                 if not has_uncreated_dependencies(v, pending_creations):
                     if k in pending_creations:
-                        statements.append(v.create_statement)
+                        emit(v.create_statement, 1, k)
                         pending_creations.remove(k)
         if modifications:
             for k, v in modified.items():
                 if not creations_only:
                     if not has_remaining_dependents(v, pending_drops):
                         if k in pending_drops:
-                            statements.append(old[k].drop_statement)
+                            emit(old[k].drop_statement, 2, k)
                             pending_drops.remove(k)
                 if not drops_only:
                     if not has_uncreated_dependencies(v, pending_creations):
                         if k in pending_creations:
-                            statements.append(v.create_statement)
+                            emit(v.create_statement, 2, k)
                             pending_creations.remove(k)
+        passes += 1
         after = pending_drops | pending_creations
         if not after:
             break
@@ -123,12 +140,15 @@ def statements_from_differences(
     return statements
 
 
-def get_enum_modifications(tables_from, tables_target, enums_from, enums_target):
+def get_enum_modifications(
+    tables_from, tables_target, enums_from, enums_target, tags=None
+):
     _, _, e_modified, _ = differences(enums_from, enums_target)
     _, _, t_modified, _ = differences(tables_from, tables_target)
     pre = Statements()
     recreate = Statements()
     post = Statements()
+    pre_tags, recreate_tags, post_tags = [], [], []
     enums_to_change = e_modified
     for t, v in t_modified.items():
         t_before = tables_from[t]
@@ -142,36 +162,48 @@ def get_enum_modifications(tables_from, tables_target, enums_from, enums_target)
             ):
                 pre.append(before.change_enum_to_string_statement(t))
                 post.append(before.change_string_to_enum_statement(t))
-    for e in enums_to_change.values():
-        recreate.append(e.drop_statement)
-        recreate.append(e.create_statement)
+                pre_tags.append((0, (t, k)))
+                post_tags.append((2, (t, k)))
+    for e, v in enums_to_change.items():
+        recreate.append(v.drop_statement)
+        recreate.append(v.create_statement)
+        recreate_tags += [(1, e), (1, e)]
+    if tags is not None:
+        tags += pre_tags + recreate_tags + post_tags
     return pre + recreate + post
 
 
-def get_table_changes(tables_from, tables_target, enums_from, enums_target):
+def get_table_changes(tables_from, tables_target, enums_from, enums_target, tags=None):
     added, removed, modified, _ = differences(tables_from, tables_target)
 
     statements = Statements()
+    tagged = []
+
+    def emit(new_statements, tag):
+        statements.extend(new_statements)
+        tagged.extend([tag] * len(new_statements))
+
     for t, v in removed.items():
-        statements.append(v.drop_statement)
+        emit([v.drop_statement], (0, t))
     for t, v in added.items():
-        statements.append(v.create_statement)
+        emit([v.create_statement], (1, t))
+    enum_tags = []
     statements += get_enum_modifications(
-        tables_from, tables_target, enums_from, enums_target
+        tables_from, tables_target, enums_from, enums_target, tags=enum_tags
     )
+    tagged += [(2,) + tag for tag in enum_tags]
 
     for t, v in modified.items():
         before = tables_from[t]
 
         # drop/recreate tables which have changed from partitioned to non-partitioned
         if v.is_partitioned != before.is_partitioned:
-            statements.append(v.drop_statement)
-            statements.append(v.create_statement)
+            emit([v.drop_statement, v.create_statement], (3, t))
             continue
 
         # attach/detach tables with changed parent tables
         if v.parent_table != before.parent_table:
-            statements += v.attach_detach_statements(before)
+            emit(v.attach_detach_statements(before), (3, t))
 
     for t, v in modified.items():
         before = tables_from[t]
@@ -182,25 +214,96 @@ def get_table_changes(tables_from, tables_target, enums_from, enums_target):
         c_added, c_removed, c_modified, _ = differences(before.columns, v.columns)
         for k, c in c_removed.items():
             alter = v.alter_table_statement(c.drop_column_clause)
-            statements.append(alter)
+            emit([alter], (4, t))
         for k, c in c_added.items():
             alter = v.alter_table_statement(c.add_column_clause)
-            statements.append(alter)
+            emit([alter], (4, t))
         for k, c in c_modified.items():
-            statements += c.alter_table_statements(before.columns[k], t)
+            emit(c.alter_table_statements(before.columns[k], t), (4, t))
 
         if v.rowsecurity != before.rowsecurity:
             rls_alter = v.alter_rls_statement
-            statements += [rls_alter]
+            emit([rls_alter], (4, t))
+    if tags is not None:
+        tags += tagged
     return statements
 
 
+def references_columns(selectable, columns):
+    """
+    Whether a selectable's definition may refer to any of the given columns.
+    Errs on the side of yes.
+    """
+    definition = getattr(selectable, "definition", None)
+    if selectable.relationtype not in ("v", "m") or not definition:
+        return True
+
+    # whole-row references, which depend on every column
+    if ".*" in definition:
+        return True
+
+    # natural joins match on columns that the definition never names
+    if re.search(r"\bnatural\b", definition, re.IGNORECASE):
+        return True
+
+    return any(
+        re.search(
+            r"(?<![\w$]){}(?![\w$])".format(re.escape(c.replace('"', '""'))),
+            definition,
+        )
+        for c in columns
+    )
+
+
+def dependents_to_recreate(old, new, selectables_from, selectables_target):
+    """
+    The dependents that must be dropped and recreated to change a selectable
+    from old to new, when it can't simply be replaced.
+
+    A table altered in place only affects the views that refer to its removed
+    or retyped columns (and anything depending on those views). Default and
+    nullability changes don't affect views at all. Anything
+    else has to take all its dependents with it.
+
+    A view blocks the alter if it refers to the columns before the migration,
+    so both its old and new definitions are checked.
+    """
+    in_place = (
+        new.is_table
+        and new.relationtype == old.relationtype
+        and new.is_partitioned == old.is_partitioned
+        and new.is_alterable
+    )
+    if not in_place:
+        return new.dependents_all
+
+    _, c_removed, c_modified, _ = differences(old.columns, new.columns)
+    columns = list(c_removed) + [
+        k
+        for k, c in c_modified.items()
+        if c.dbtypestr != old.columns[k].dbtypestr
+        or c.collation != old.columns[k].collation
+    ]
+
+    recreate = []
+    for d in sorted(set(old.dependents) | set(new.dependents)):
+        versions = [
+            v for v in (selectables_from.get(d), selectables_target.get(d)) if v
+        ]
+        if not versions or any(references_columns(v, columns) for v in versions):
+            recreate.append(d)
+            for v in versions:
+                recreate += v.dependents_all
+    return recreate
+
+
 def get_selectable_changes(
     selectables_from,
     selectables_target,
     enums_from,
     enums_target,
     add_dependents_for_modified=True,
+    tags=None,
 ):
     tables_from = od((k, v) for k, v in selectables_from.items() if v.is_table)
     tables_target = od((k, v) for k, v in selectables_target.items() if v.is_table)
@@ -234,7 +337,16 @@ def get_selectable_changes(
                     replaceable.add(k)
                 continue
 
-            for d in m.dependents_all:
+            if k in modified_all:
+                dependents = dependents_to_recreate(
+                    old, m, selectables_from, selectables_target
+                )
+            else:
+                dependents = m.dependents_all
+
+            for d in dependents:
+                if d in not_replaceable:
+                    continue
                 if d in unmodified_other:
                     dd = unmodified_other.pop(d)
                     modified_other[d] = dd
@@ -243,6 +355,7 @@ def get_selectable_changes(
 
     replaceable -= not_replaceable
     statements = Statements()
+    drop_tags, table_tags, create_tags = [], [], []
 
     def functions(d):
         return {k: v for k, v in d.items() if v.relationtype == "f"}
@@ -255,13 +368,15 @@ def get_selectable_changes(
         drops_only=True,
         dependency_ordering=True,
         old=selectables_from,
+        tags=drop_tags,
     )
 
     statements += get_table_changes(
-        tables_from, tables_target, enums_from, enums_target
+        tables_from, tables_target, enums_from, enums_target, tags=table_tags
     )
 
-    if any([functions(added_other), functions(modified_other)]):
+    check_function_bodies = any([functions(added_other), functions(modified_other)])
+    if check_function_bodies:
         statements += ["set check_function_bodies = off;"]
 
     statements += statements_from_differences(
@@ -272,10 +387,145 @@ def get_selectable_changes(
         creations_only=True,
         dependency_ordering=True,
         old=selectables_from,
+        tags=create_tags,
     )
+
+    if tags is not None:
+        tags += [(0,) + tag for tag in drop_tags]
+        tags += [(1,) + tag for tag in table_tags]
+        if check_function_bodies:
+            tags.append(ONCE)
+        tags += [(3,) + tag for tag in create_tags]
     return statements
 
 
+def group_privileges(privileges):
+    """
+    Group privileges into sorted (object type, schema, object names, roles,
+    privileges) tuples that can each be granted or revoked with one statement.
+
+    Groups never span schemas, so sharded diffs group the same way.
+    """
+    held = od()
+    for p in privileges.values():
+        held.setdefault((p.object_type, p.schema, p.quoted_full_name), od())
+        held[(p.object_type, p.schema, p.quoted_full_name)].setdefault(
+            p.target_user, set()
+        ).add(p.privilege)
+
+    by_grant = od()
+    for (object_type, schema, name), roles in held.items():
+        for role, privs in roles.items():
+            grant = (object_type, schema, role, tuple(sorted(privs)))
+            by_grant.setdefault(grant, []).append(name)
+
+    by_objects = od()
+    for (object_type, schema, role, privs), names in by_grant.items():
+        objects = (object_type, schema, tuple(sorted(names)), privs)
+        by_objects.setdefault(objects, []).append(role)
+
+    return sorted(
+        (object_type, schema, names, tuple(sorted(roles)), privs)
+        for (object_type, schema, names, privs), roles in by_objects.items()
+    )
+
+
+def privilege_statements(privileges, keyword, preposition, tags=None, section=0):
+    by_key = od(
+        ((p.object_type, p.quoted_full_name, p.target_user, p.privilege), p)
+        for p in privileges.values()
+    )
+    statements = Statements()
+    for group in group_privileges(privileges):
+        object_type, schema, names, roles, privs = group
+        if len(names) == len(roles) == len(privs) == 1:
+            p = by_key[(object_type, names[0], roles[0], privs[0])]
+            statement = p.create_statement if keyword == "grant" else p.drop_statement
+        else:
+            statement = "{} {} on {} {} {} {};".format(
+                keyword,
+                ", ".join(privs),
+                object_type,
+                ", ".join(names),
+                preposition,
+                ", ".join(quoted_identifier(r) for r in roles),
+            )
+        statements.append(statement)
+        if tags is not None:
+            tags.append((0, section, group))
+    return statements
+
+
+def get_privilege_changes(
+    privileges_from,
+    privileges_target,
+    creations_only=False,
+    drops_only=False,
+    modifications=True,
+    tags=None,
+):
+    """
+    Like statements_for_changes, but collapsing identical grants and revokes
+    across objects, roles and privilege types into bulk statements.
+    """
+    added, removed, modified, _ = differences(privileges_from, privileges_target)
+
+    to_revoke = od(removed)
+    to_grant = od(added)
+    if modifications:
+        to_revoke.update((k, privileges_from[k]) for k in modified)
+        to_grant.update(modified)
+
+    statements = Statements()
+    if not creations_only:
+        statements += privilege_statements(
+            to_revoke, "revoke", "from", tags=tags, section=0
+        )
+    if not drops_only:
+        statements += privilege_statements(
+            to_grant, "grant", "to", tags=tags, section=1
+        )
+    return statements
+
+
+def change_phases(privileges=False):
+    """
+    The (change type, arguments) pairs that make up a full migration, in order.
+    """
+    phases = [
+        ("schemas", dict(creations_only=True)),
+        ("extensions", dict(creations_only=True)),
+        ("collations", dict(creations_only=True)),
+        ("enums", dict(creations_only=True, modifications=False)),
+        ("sequences", dict(creations_only=True)),
+        ("triggers", dict(drops_only=True)),
+        ("rlspolicies", dict(drops_only=True)),
+    ]
+    if privileges:
+        phases.append(("privileges", dict(drops_only=True)))
+    phases += [
+        ("non_pk_constraints", dict(drops_only=True)),
+        ("pk_constraints", dict(drops_only=True)),
+        ("indexes", dict(drops_only=True)),
+        ("selectables", dict()),
+        ("sequences", dict(drops_only=True)),
+        ("enums", dict(drops_only=True, modifications=False)),
+        ("extensions", dict(drops_only=True)),
+        ("indexes", dict(creations_only=True)),
+        ("pk_constraints", dict(creations_only=True)),
+        ("non_pk_constraints", dict(creations_only=True)),
+    ]
+    if privileges:
+        phases.append(("privileges", dict(creations_only=True)))
+    phases += [
+        ("rlspolicies", dict(creations_only=True)),
+        ("triggers", dict(creations_only=True)),
+        ("collations", dict(drops_only=True)),
+        ("schemas", dict(drops_only=True)),
+    ]
+    return phases
+
+
 class Changes(object):
     def __init__(self, i_from, i_target):
         self.i_from = i_from
@@ -296,6 +546,13 @@ class Changes(object):
             b_od = od((k, v) for k, v in b if v.constraint_type == PK)
             return partial(statements_for_changes, a_od, b_od)
 
+        elif name == "privileges":
+            return partial(
+                get_privilege_changes,
+                self.i_from.privileges,
+                self.i_target.privileges,
+            )
+
         elif name == "selectables":
             return partial(
                 get_selectable_changes,
@@ -2,12 +2,21 @@ from __future__ import print_function, unicode_literals
 
 import argparse
 import sys
+import time
 from contextlib import contextmanager
 
 from sqlbag import S
 
 from .migra import Migration
 from .statements import UnsafeMigrationException
+from .watch import (
+    catalog_fingerprint,
+    end_transactions,
+    format_delta,
+    statement_delta,
+)
+
+DESTRUCTIVE = "-- ERROR: destructive statements generated. Use the --unsafe flag to suppress this error."
 
 
 @contextmanager
@@ -55,6 +64,27 @@ def parse_args(args):
         default=False,
         help="Force UTF-8 encoding for output",
     )
+    parser.add_argument(
+        "--processes",
+        dest="processes",
+        type=int,
+        default=None,
+        help="Diff independent parts of the schema in this many worker processes",
+    )
+    parser.add_argument(
+        "--watch",
+        dest="watch",
+        action="store_true",
+        default=False,
+        help="Keep running, printing changes to the migration whenever either database schema changes",
+    )
+    parser.add_argument(
+        "--interval",
+        dest="interval",
+        type=float,
+        default=1.0,
+        help="Seconds between schema change checks in --watch mode",
+    )
     parser.add_argument("dburl_from", help="The database you want to migrate.")
     parser.add_argument(
         "dburl_target", help="The database you want to use as the target."
@@ -62,7 +92,16 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
+def add_changes(m, args):
+    if args.create_extensions_only:
+        m.add_extension_changes(drops=False)
+    else:
+        m.add_all_changes(privileges=args.with_privileges, processes=args.processes)
+
+
 def run(args, out=None, err=None):
+    if args.watch:
+        return watch(args, out=out, err=err)
     schema = args.schema
     if not out:
         out = sys.stdout  # pragma: no cover
@@ -72,10 +111,7 @@ def run(args, out=None, err=None):
         m = Migration(ac0, ac1, schema=schema)
         if args.unsafe:
             m.set_safety(False)
-        if args.create_extensions_only:
-            m.add_extension_changes(drops=False)
-        else:
-            m.add_all_changes(privileges=args.with_privileges)
+        add_changes(m, args)
         try:
             if m.statements:
                 if args.force_utf8:
@@ -83,10 +119,7 @@ def run(args, out=None, err=None):
                 else:
                     print(m.sql, file=out)
         except UnsafeMigrationException:
-            print(
-                "-- ERROR: destructive statements generated. Use the --unsafe flag to suppress this error.",
-                file=err,
-            )
+            print(DESTRUCTIVE, file=err)
             return 3
 
         if not m.statements:
@@ -96,6 +129,60 @@ def run(args, out=None, err=None):
             return 2
 
 
+def watch(args, out=None, err=None, polls=None, sleep=time.sleep):
+    if not out:
+        out = sys.stdout  # pragma: no cover
+    if not err:
+        err = sys.stderr  # pragma: no cover
+    with arg_context(args.dburl_from) as ac0, arg_context(args.dburl_target) as ac1:
+        m = None
+        fingerprints = None
+        previous = None
+        count = 0
+        try:
+            while polls is None or count < polls:
+                if count:
+                    end_transactions(ac0, ac1)
+                    sleep(args.interval)
+                count += 1
+
+                current = (catalog_fingerprint(ac0), catalog_fingerprint(ac1))
+                if m is None:
+                    m = Migration(ac0, ac1, schema=args.schema)
+                elif current == fingerprints:
+                    continue
+                else:
+                    if current[0] != fingerprints[0]:
+                        m.inspect_from()
+                    if current[1] != fingerprints[1]:
+                        m.inspect_target()
+                fingerprints = current
+
+                m.clear()
+                m.set_safety(not args.unsafe)
+                add_changes(m, args)
+                try:
+                    sql = m.sql
+                except UnsafeMigrationException:
+                    print(DESTRUCTIVE, file=err)
+                    err.flush()
+                    continue
+
+                statements = list(m.statements)
+                if previous is None:
+                    if statements:
+                        print(sql, file=out)
+                else:
+                    delta = format_delta(statement_delta(previous, statements))
+                    if delta:
+                        print(delta, file=out)
+                out.flush()
+                previous = statements
+        except KeyboardInterrupt:  # pragma: no cover
+            pass
+    return 0
+
+
 def do_command():  # pragma: no cover
     args = parse_args(sys.argv[1:])
     status = run(args)
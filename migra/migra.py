@@ -4,7 +4,8 @@ from sqlbag import raw_execute
 
 from schemainspect import DBInspector, get_inspector
 
-from .changes import Changes
+from .changes import Changes, change_phases
+from .parallel import parallel_changes
 from .statements import Statements
 
 
@@ -62,35 +63,20 @@ class Migration(object):
         if drops:
             self.add(self.changes.extensions(drops_only=True))
 
-    def add_all_changes(self, privileges=False):
-        self.add(self.changes.schemas(creations_only=True))
-
-        self.add(self.changes.extensions(creations_only=True))
-        self.add(self.changes.collations(creations_only=True))
-        self.add(self.changes.enums(creations_only=True, modifications=False))
-        self.add(self.changes.sequences(creations_only=True))
-        self.add(self.changes.triggers(drops_only=True))
-        self.add(self.changes.rlspolicies(drops_only=True))
-        if privileges:
-            self.add(self.changes.privileges(drops_only=True))
-        self.add(self.changes.non_pk_constraints(drops_only=True))
-        self.add(self.changes.pk_constraints(drops_only=True))
-        self.add(self.changes.indexes(drops_only=True))
-
-        self.add(self.changes.selectables())
-
-        self.add(self.changes.sequences(drops_only=True))
-        self.add(self.changes.enums(drops_only=True, modifications=False))
-        self.add(self.changes.extensions(drops_only=True))
-        self.add(self.changes.indexes(creations_only=True))
-        self.add(self.changes.pk_constraints(creations_only=True))
-        self.add(self.changes.non_pk_constraints(creations_only=True))
-        if privileges:
-            self.add(self.changes.privileges(creations_only=True))
-        self.add(self.changes.rlspolicies(creations_only=True))
-        self.add(self.changes.triggers(creations_only=True))
-        self.add(self.changes.collations(drops_only=True))
-        self.add(self.changes.schemas(drops_only=True))
+    def add_all_changes(self, privileges=False, processes=None):
+        if processes and processes > 1:
+            self.add(
+                parallel_changes(
+                    self.changes.i_from,
+                    self.changes.i_target,
+                    privileges=privileges,
+                    processes=processes,
+                )
+            )
+            return
+
+        for name, kwargs in change_phases(privileges=privileges):
+            self.add(getattr(self.changes, name)(**kwargs))
 
     @property
     def sql(self):
@@ -0,0 +1,151 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict as od
+from concurrent.futures import ProcessPoolExecutor
+
+from .changes import ONCE, Changes, change_phases
+from .statements import Statements
+
+SHARDED = [
+    "schemas",
+    "extensions",
+    "collations",
+    "enums",
+    "sequences",
+    "triggers",
+    "rlspolicies",
+    "privileges",
+    "constraints",
+    "indexes",
+    "selectables",
+]
+
+
+class ShardInspector(object):
+    """
+    A picklable stand-in for an inspector, holding a subset of its objects.
+    """
+
+    def __init__(self):
+        for name in SHARDED:
+            setattr(self, name, od())
+
+
+def selectable_components(i_from, i_target):
+    """
+    Group selectables from both sides into connected components of the
+    dependency graph, returning a dict of key -> component root.
+    """
+    parents = {}
+
+    def find(k):
+        parents.setdefault(k, k)
+        while parents[k] != k:
+            parents[k] = parents[parents[k]]
+            k = parents[k]
+        return k
+
+    def union(a, b):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parents[max(ra, rb)] = min(ra, rb)
+
+    for i in (i_from, i_target):
+        for k, v in getattr(i, "selectables", {}).items():
+            find(k)
+            for d in list(v.dependents) + list(v.dependent_on):
+                union(k, d)
+
+    return {k: find(k) for k in parents}
+
+
+def shard_inspectors(i_from, i_target, shard_count):
+    """
+    Split the objects of both inspectors into at most shard_count pairs of
+    ShardInspectors that can be diffed independently of each other.
+
+    Selectables are kept together with everything they depend on or that
+    depends on them. Other objects are diffed without dependency ordering,
+    so they are simply grouped by schema.
+    """
+    components = selectable_components(i_from, i_target)
+
+    units = od()
+    for name in SHARDED:
+        for side, i in enumerate((i_from, i_target)):
+            for k, v in getattr(i, name, {}).items():
+                if name == "selectables":
+                    unit = ("selectables", components[k])
+                else:
+                    unit = ("schema", getattr(v, "schema", None) or "")
+                units.setdefault(unit, []).append((name, side, k, v))
+
+    # largest units first, each into the currently smallest shard
+    ordered = sorted(units.items(), key=lambda x: (-len(x[1]), x[0]))
+    shards = [[] for _ in range(max(1, min(shard_count, len(ordered))))]
+    for _, objects in ordered:
+        smallest = min(shards, key=len)
+        smallest.extend(objects)
+
+    result = []
+    for objects in shards:
+        pair = (ShardInspector(), ShardInspector())
+        for name, side, k, v in objects:
+            getattr(pair[side], name)[k] = v
+        result.append(pair)
+    return result
+
+
+def diff_shard(args):
+    i_from, i_target, phases = args
+    changes = Changes(i_from, i_target)
+    results = []
+    for name, kwargs in phases:
+        tags = []
+        statements = getattr(changes, name)(tags=tags, **kwargs)
+        results.append((list(statements), tags))
+    return results
+
+
+def merge_tagged(outputs):
+    """
+    Merge the tagged statements of a single change phase, as produced by
+    each shard, into the order the unsharded diff would produce.
+    """
+    tagged = []
+    for statements, tags in outputs:
+        tagged.extend(zip(tags, statements))
+
+    # stable, so statements sharing a tag keep their original order
+    tagged.sort(key=lambda x: x[0])
+
+    merged = Statements()
+    seen_once = False
+    for tag, statement in tagged:
+        if tag == ONCE:
+            if seen_once:
+                continue
+            seen_once = True
+        merged.append(statement)
+    return merged
+
+
+def parallel_changes(i_from, i_target, privileges=False, processes=None):
+    """
+    Produce the same statements as Migration.add_all_changes, but diffing
+    independent shards of the schema in a pool of worker processes.
+    """
+    phases = change_phases(privileges=privileges)
+    shards = shard_inspectors(i_from, i_target, processes or 1)
+    jobs = [(a, b, phases) for a, b in shards]
+
+    if len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=len(jobs)) as executor:
+            results = list(executor.map(diff_shard, jobs))
+    else:
+        results = [diff_shard(job) for job in jobs]
+
+    statements = Statements()
+    for i, _ in enumerate(phases):
+        statements += merge_tagged(r[i] for r in results)
+    return statements
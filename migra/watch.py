@@ -0,0 +1,82 @@
+from __future__ import unicode_literals
+
+from difflib import SequenceMatcher
+
+# Any DDL or grant/revoke inserts, updates or deletes rows in at least one of
+# these catalogs, which changes that catalog's row count or the sum of its
+# row xmins. This is much cheaper to check than a full inspection.
+CATALOGS = [
+    ("pg_namespace", None),
+    ("pg_class", None),
+    ("pg_attribute", None),
+    ("pg_attrdef", None),
+    ("pg_constraint", None),
+    ("pg_index", None),
+    ("pg_inherits", None),
+    ("pg_rewrite", None),
+    ("pg_proc", None),
+    ("pg_type", None),
+    ("pg_enum", None),
+    ("pg_sequence", (10,)),
+    ("pg_trigger", None),
+    ("pg_policy", (9, 5)),
+    ("pg_extension", None),
+    ("pg_collation", None),
+    ("pg_depend", None),
+]
+
+
+def fingerprint_query(server_version):
+    """
+    The fingerprint query for the catalogs a server of the given version has.
+    """
+    return "\nunion all\n".join(
+        "select '{0}', count(*), coalesce(sum(xmin::text::bigint), 0) from {0}".format(
+            name
+        )
+        for name, min_version in CATALOGS
+        if min_version is None or server_version >= min_version
+    )
+
+
+def catalog_fingerprint(s):
+    """
+    A cheap value that changes whenever the schema of the database changes.
+    """
+    if s is None:
+        return None
+    server_version = s.connection().dialect.server_version_info
+    return tuple(tuple(row) for row in s.execute(fingerprint_query(server_version)))
+
+
+def end_transactions(*sessions):
+    """
+    Commit the given sessions, so that none of them holds a snapshot open
+    while waiting for the next poll.
+    """
+    for s in sessions:
+        if s is not None:
+            s.commit()
+
+
+def statement_delta(before, after):
+    """
+    Yield ("-", statement) and ("+", statement) pairs describing how one list of
+    statements differs from another.
+    """
+    matcher = SequenceMatcher(a=list(before), b=list(after), autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        for statement in before[i1:i2]:
+            yield "-", statement
+        for statement in after[j1:j2]:
+            yield "+", statement
+
+
+def format_delta(delta):
+    lines = []
+    for sign, statement in delta:
+        for line in statement.splitlines():
+            lines.append("{} {}".format(sign, line))
+    return "\n".join(lines)
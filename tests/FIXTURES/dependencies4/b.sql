@@ -0,0 +1,7 @@
+create table basetable(id integer, name varchar, kept text);
+
+create view aaa_name as select id from basetable where name is not null;
+
+create view bbb_name as select id from aaa_name;
+
+create view ccc_kept as select kept from basetable;
@@ -0,0 +1,13 @@
+drop view if exists "public"."bbb_name";
+
+drop view if exists "public"."aaa_name";
+
+alter table "public"."basetable" alter column "name" set data type varchar using "name"::varchar;
+
+create or replace view "public"."aaa_name" as  SELECT basetable.id
+   FROM basetable
+  WHERE (basetable.name IS NOT NULL);
+
+
+create or replace view "public"."bbb_name" as  SELECT aaa_name.id
+   FROM aaa_name;
@@ -0,0 +1,3 @@
+create table basetable(id integer, name text, kept text);
+
+create view v as select id, name as nm from basetable;
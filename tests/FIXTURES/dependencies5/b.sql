@@ -0,0 +1,3 @@
+create table basetable(id integer, name varchar, kept text);
+
+create view v as select id, kept as nm from basetable;
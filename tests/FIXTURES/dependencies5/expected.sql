@@ -0,0 +1,7 @@
+drop view if exists "public"."v";
+
+alter table "public"."basetable" alter column "name" set data type varchar using "name"::varchar;
+
+create or replace view "public"."v" as  SELECT basetable.id,
+    basetable.kept AS nm
+   FROM basetable;
@@ -0,0 +1,9 @@
+create table a(id integer, name text);
+
+create table basetable(id integer, name text, kept text);
+
+create view v as select kept from a natural join basetable;
+
+create table other(id integer, flag integer);
+
+create view w as select id, flag from other;
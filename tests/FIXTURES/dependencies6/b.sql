@@ -0,0 +1,9 @@
+create table a(id integer, name text);
+
+create table basetable(id integer, name varchar, kept text);
+
+create view v as select kept from a natural join basetable;
+
+create table other(id integer, flag integer default 0 not null);
+
+create view w as select id, flag from other;
@@ -0,0 +1,11 @@
+drop view if exists "public"."v";
+
+alter table "public"."basetable" alter column "name" set data type varchar using "name"::varchar;
+
+alter table "public"."other" alter column "flag" set default 0;
+
+alter table "public"."other" alter column "flag" set not null;
+
+create or replace view "public"."v" as  SELECT basetable.kept
+   FROM (a
+     NATURAL JOIN basetable);
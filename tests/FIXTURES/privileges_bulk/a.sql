@@ -0,0 +1,5 @@
+create table t1 (id integer);
+
+create table t2 (id integer);
+
+create table old (id integer);
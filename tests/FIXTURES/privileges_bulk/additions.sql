@@ -0,0 +1 @@
+create table t3 (id integer);
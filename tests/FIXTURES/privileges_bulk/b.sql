@@ -0,0 +1,5 @@
+create table t1 (id integer);
+
+create table t2 (id integer);
+
+grant select, insert on all tables in schema public to schemainspect_test_role;
@@ -0,0 +1,3 @@
+drop table "public"."old";
+
+grant insert, select on table "public"."t1", "public"."t2" to "schemainspect_test_role";
@@ -0,0 +1,5 @@
+drop table "public"."old";
+
+drop table "public"."t3";
+
+grant insert, select on table "public"."t1", "public"."t2" to "schemainspect_test_role";
@@ -0,0 +1,61 @@
+import glob
+
+from sqlbag import admin_db_connection, drop_database
+
+from .test_migra import database_url, template_name
+
+
+def pytest_sessionstart(session):
+    """
+    Drop fixture template databases left over from earlier versions of the
+    fixtures, so they don't pile up as fixtures change.
+    """
+    # with xdist, only the controlling process cleans up, before any worker
+    # starts using the templates
+    if hasattr(session.config, "workerinput"):
+        return
+
+    current = set(
+        template_name(path) for path in glob.glob("tests/FIXTURES/*/[ab].sql")
+    )
+    with admin_db_connection(database_url("postgres")) as c:
+        existing = [
+            row[0]
+            for row in c.execute(
+                "select datname from pg_database where datname ~ '^migra_template_'"
+            )
+        ]
+    for name in sorted(set(existing) - current):
+        drop_database(database_url(name))
+
+
+def pytest_terminal_summary(terminalreporter):
+    """
+    Show how long each fixture test spent setting up databases, separately
+    from the time spent inspecting, diffing and applying.
+    """
+    rows = []
+    for outcome in ("passed", "failed"):
+        for report in terminalreporter.getreports(outcome):
+            properties = dict(report.user_properties)
+            if report.when == "call" and "setup_seconds" in properties:
+                rows.append(
+                    (
+                        properties["setup_seconds"],
+                        properties["diff_seconds"],
+                        report.nodeid,
+                    )
+                )
+
+    if rows:
+        terminalreporter.write_sep("-", "fixture timings (seconds)")
+        terminalreporter.write_line("{:>8} {:>8}".format("setup", "diff"))
+        for setup, diff, nodeid in sorted(rows, key=lambda row: row[2]):
+            terminalreporter.write_line(
+                "{:>8.2f} {:>8.2f}  {}".format(setup, diff, nodeid)
+            )
+        terminalreporter.write_line(
+            "{:>8.2f} {:>8.2f}  total".format(
+                sum(row[0] for row in rows), sum(row[1] for row in rows)
+            )
+        )
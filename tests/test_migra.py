@@ -1,12 +1,33 @@
 from __future__ import unicode_literals
 
+import asyncio
+import getpass
+import hashlib
 import io
-
-from pytest import raises
-from sqlbag import S, load_sql_from_file, temporary_database
-
+import time
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from pytest import mark, raises
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+from sqlbag import (
+    S,
+    admin_db_connection,
+    create_database,
+    database_exists,
+    drop_database,
+    load_sql_from_file,
+    quoted_identifier,
+    temporary_database,
+)
+from sqlbag.createdrop import temporary_name
+
+import migra.migra
 from migra import Migration, Statements, UnsafeMigrationException
-from migra.command import parse_args, run
+from migra.aio import AsyncMigration, async_arg_context
+from migra.command import parse_args, run, watch
+from migra.watch import fingerprint_query, format_delta, statement_delta
 from schemainspect import get_inspector
 
 SQL = """select 1;
@@ -34,79 +55,243 @@ def outs():
     return io.StringIO(), io.StringIO()
 
 
-def test_deps():
-    for FIXTURE_NAME in ["dependencies", "dependencies2", "dependencies3"]:
-        do_fixture_test(FIXTURE_NAME)
+@mark.parametrize(
+    "fixture_name",
+    [
+        "dependencies",
+        "dependencies2",
+        "dependencies3",
+        "dependencies4",
+        "dependencies5",
+        "dependencies6",
+    ],
+)
+def test_deps(fixture_name, record_property):
+    do_fixture_test(fixture_name, record_property=record_property)
+
+
+@mark.parametrize("fixture_name", ["everything"])
+def test_everything(fixture_name, record_property):
+    do_fixture_test(fixture_name, with_privileges=True, record_property=record_property)
+
+
+@mark.parametrize("fixture_name", ["partitioning"])
+def test_partitioning(fixture_name, record_property):
+    do_fixture_test(fixture_name, record_property=record_property)
+
+
+@mark.parametrize("fixture_name", ["inherit"])
+def test_inherit(fixture_name, record_property):
+    do_fixture_test(fixture_name, record_property=record_property)
+
+
+@mark.parametrize("fixture_name", ["collations"])
+def test_collations(fixture_name, record_property):
+    do_fixture_test(fixture_name, record_property=record_property)
+
+
+@mark.parametrize("fixture_name", ["triggers", "triggers2"])
+def test_triggers(fixture_name, record_property):
+    do_fixture_test(fixture_name, record_property=record_property)
 
 
-def test_everything():
-    for FIXTURE_NAME in ["everything"]:
-        do_fixture_test(FIXTURE_NAME, with_privileges=True)
+@mark.parametrize("fixture_name", ["singleschema"])
+def test_singleschemea(fixture_name, record_property):
+    do_fixture_test(fixture_name, schema="goodschema", record_property=record_property)
 
 
-def test_partitioning():
-    for FIXTURE_NAME in ["partitioning"]:
-        do_fixture_test(FIXTURE_NAME)
+@mark.parametrize("fixture_name", ["singleschema_ext"])
+def test_singleschema_ext(fixture_name, record_property):
+    do_fixture_test(
+        fixture_name, create_extensions_only=True, record_property=record_property
+    )
+
+
+@mark.parametrize("fixture_name", ["privileges", "privileges_bulk"])
+def test_privs(fixture_name, record_property):
+    do_fixture_test(fixture_name, with_privileges=True, record_property=record_property)
 
 
-def test_inherit():
-    for FIXTURE_NAME in ["inherit"]:
-        do_fixture_test(FIXTURE_NAME)
+def test_statement_delta():
+    delta = list(statement_delta(["select 1;", "select 2;"], ["select 1;", DROP]))
+    assert delta == [("-", "select 2;"), ("+", DROP)]
+    assert format_delta(delta) == "- select 2;\n+ drop table x;"
 
 
-def test_collations():
-    for FIXTURE_NAME in ["collations"]:
-        do_fixture_test(FIXTURE_NAME)
+def test_fingerprint_query():
+    assert "pg_sequence" not in fingerprint_query((9, 6, 24))
+    assert "pg_policy" in fingerprint_query((9, 6, 24))
+    assert "pg_policy" not in fingerprint_query((9, 4, 26))
+    assert "pg_sequence" in fingerprint_query((14, 2))
+
+
+def test_watch():
+    with temporary_database(host="localhost") as d0, temporary_database(
+        host="localhost"
+    ) as d1:
+        for d in (d0, d1):
+            with S(d) as s:
+                s.execute("create table t(id integer);")
 
+        pending = ["alter table t add column name text;", None]
 
-def test_triggers():
-    for FIXTURE_NAME in ["triggers", "triggers2"]:
-        do_fixture_test(FIXTURE_NAME)
+        def sleep(interval):
+            assert interval == 0.0
+            ddl = pending.pop(0)
+            if ddl:
+                with S(d1) as s1:
+                    s1.execute(ddl)
 
+        args = parse_args(["--watch", "--interval", "0", d0, d1])
+        assert args.watch
+        out, err = outs()
+        assert watch(args, out=out, err=err, polls=3, sleep=sleep) == 0
+        assert not pending
+        assert err.getvalue() == ""
+        assert out.getvalue() == '+ alter table "public"."t" add column "name" text;\n'
 
-def test_singleschemea():
-    for FIXTURE_NAME in ["singleschema"]:
-        do_fixture_test(FIXTURE_NAME, schema="goodschema")
 
+def test_async():
+    fixture_path = "tests/FIXTURES/dependencies/"
+    EXPECTED = io.open(fixture_path + "expected.sql").read().strip()
+    with fixture_databases(fixture_path) as (d0, d1):
+
+        async def migrate():
+            async with async_arg_context(d0) as c0, async_arg_context(d1) as c1:
+                m = AsyncMigration(c0, c1)
+                await m.inspect()
+                m.set_safety(False)
+                m.add_all_changes()
+                assert m.sql.strip() == EXPECTED
+                await m.apply()
+                m.add_all_changes()
+                assert m.changes.i_from == m.changes.i_target
+                assert not m.statements
 
-def test_singleschema_ext():
-    for FIXTURE_NAME in ["singleschema_ext"]:
-        do_fixture_test(FIXTURE_NAME, create_extensions_only=True)
+                m.add_sql("create table extra_a(id int); create table extra_b(id int);")
+                await m.apply()
+                assert '"public"."extra_a"' in m.changes.i_from.tables
+                assert '"public"."extra_b"' in m.changes.i_from.tables
 
+            async with async_arg_context("EMPTY") as c0:
+                m = AsyncMigration(c0, get_inspector(None))
+                await m.inspect()
+                m.add_all_changes()
+                assert m.sql == ""
 
-def test_privs():
-    for FIXTURE_NAME in ["privileges"]:
-        do_fixture_test(FIXTURE_NAME, with_privileges=True)
+        asyncio.run(migrate())
 
 
 schemainspect_test_role = "schemainspect_test_role"
 
 
 def create_role(s, rolename):
-    role = s.execute(
-        f"""
-SELECT 1 FROM pg_roles WHERE rolname=:rolename
-    """,
-        dict(rolename=rolename),
-    )
+    # tolerate other test processes creating the role at the same time
+    s.execute(f"""
+do $$
+begin
+    create role {rolename};
+exception when duplicate_object or unique_violation then
+    null;
+end
+$$;
+    """)
+
+
+def database_url(name):
+    return "postgresql://{}@localhost/{}".format(getpass.getuser(), name)
+
+
+def template_name(sql_path):
+    """
+    The name of the template database for sql_path, which changes whenever
+    the sql does.
+    """
+    sql = io.open(sql_path).read()
+    digest = hashlib.sha1((sql_path + sql).encode("utf-8")).hexdigest()[:16]
+    return "migra_template_" + digest
+
+
+def fixture_template(sql_path):
+    """
+    The url of a template database with sql_path loaded into it.
+
+    Templates are named after a hash of their sql and are kept between test
+    runs, so each is only built the first time it's needed. Templates for
+    sql that has since changed are dropped when a test session starts.
+    """
+    url = database_url(template_name(sql_path))
+
+    if not database_exists(url):
+        building = database_url(temporary_name("migra_building_"))
+        create_database(building)
+        try:
+            with S(building, poolclass=NullPool) as s:
+                create_role(s, schemainspect_test_role)
+                load_sql_from_file(s, sql_path)
+            with admin_db_connection(building) as c:
+                c.execute(
+                    "alter database {} rename to {};".format(
+                        quoted_identifier(make_url(building).database),
+                        quoted_identifier(make_url(url).database),
+                    )
+                )
+        except Exception:
+            drop_database(building)
+            # fine if another test process built the same template first
+            if not database_exists(url):
+                raise
+    return url
 
-    role_exists = bool(list(role))
 
-    if not role_exists:
-        s.execute(
-            f"""
-            create role {rolename};
-        """
-        )
+@contextmanager
+def cloned_database(template_url):
+    url = database_url(temporary_name())
+    create_database(url, template=make_url(template_url).database)
+    try:
+        yield url
+    finally:
+        drop_database(url)
+
+
+@contextmanager
+def fixture_databases(fixture_path):
+    with cloned_database(fixture_template(fixture_path + "a.sql")) as d0:
+        with cloned_database(fixture_template(fixture_path + "b.sql")) as d1:
+            yield d0, d1
+
 
+@contextmanager
+def shared_inspection(inspections):
+    """
+    Reuse inspection results per database and schema, for as long as the
+    databases aren't being changed.
+    """
+    inspect = migra.migra.get_inspector
 
-def test_rls():
-    for FIXTURE_NAME in ["rls"]:
-        do_fixture_test(FIXTURE_NAME, with_privileges=True)
+    def get_inspector(x, schema=None):
+        if x is None:
+            return inspect(x, schema=schema)
+        key = (str(x.get_bind().url), schema)
+        if key not in inspections:
+            inspections[key] = inspect(x, schema=schema)
+        return inspections[key]
+
+    with patch.object(migra.migra, "get_inspector", get_inspector):
+        yield
+
+
+@mark.parametrize("fixture_name", ["rls"])
+def test_rls(fixture_name, record_property):
+    do_fixture_test(fixture_name, with_privileges=True, record_property=record_property)
 
 
 def do_fixture_test(
-    fixture_name, schema=None, create_extensions_only=False, with_privileges=False
+    fixture_name,
+    schema=None,
+    create_extensions_only=False,
+    with_privileges=False,
+    record_property=None,
 ):
     flags = ["--unsafe"]
     if schema:
@@ -117,81 +302,120 @@ def do_fixture_test(
         flags += ["--with-privileges"]
     fixture_path = "tests/FIXTURES/{}/".format(fixture_name)
     EXPECTED = io.open(fixture_path + "expected.sql").read().strip()
-    with temporary_database(host="localhost") as d0, temporary_database(
-        host="localhost"
-    ) as d1:
-        with S(d0) as s0:
-            create_role(s0, schemainspect_test_role)
-        with S(d0) as s0, S(d1) as s1:
-            load_sql_from_file(s0, fixture_path + "a.sql")
-            load_sql_from_file(s1, fixture_path + "b.sql")
-        args = parse_args([d0, d1])
-        assert not args.unsafe
-        assert args.schema is None
-        out, err = outs()
-        assert run(args, out=out, err=err) == 3
-        assert out.getvalue() == ""
-
-        DESTRUCTIVE = "-- ERROR: destructive statements generated. Use the --unsafe flag to suppress this error.\n"
-
-        assert err.getvalue() == DESTRUCTIVE
-
-        args = parse_args(flags + [d0, d1])
-        assert args.unsafe
-        assert args.schema == schema
-        out, err = outs()
-        assert run(args, out=out, err=err) == 2
-        assert err.getvalue() == ""
-        assert out.getvalue().strip() == EXPECTED
-        ADDITIONS = io.open(fixture_path + "additions.sql").read().strip()
-        EXPECTED2 = io.open(fixture_path + "expected2.sql").read().strip()
+    started = time.perf_counter()
+    with fixture_databases(fixture_path) as (d0, d1):
+        setup_done = time.perf_counter()
+        inspections = {}
+        with shared_inspection(inspections):
+            do_cli_checks(d0, d1, flags, schema, EXPECTED)
+        do_api_checks(
+            d0,
+            d1,
+            flags,
+            fixture_path,
+            schema,
+            create_extensions_only,
+            with_privileges,
+            EXPECTED,
+            inspections,
+        )
+        diff_done = time.perf_counter()
+    if record_property:
+        record_property("setup_seconds", setup_done - started)
+        record_property("diff_seconds", diff_done - setup_done)
+
+
+def do_cli_checks(d0, d1, flags, schema, EXPECTED):
+    args = parse_args([d0, d1])
+    assert not args.unsafe
+    assert args.schema is None
+    out, err = outs()
+    assert run(args, out=out, err=err) == 3
+    assert out.getvalue() == ""
+
+    DESTRUCTIVE = "-- ERROR: destructive statements generated. Use the --unsafe flag to suppress this error.\n"
+
+    assert err.getvalue() == DESTRUCTIVE
+
+    args = parse_args(flags + [d0, d1])
+    assert args.unsafe
+    assert args.schema == schema
+    out, err = outs()
+    assert run(args, out=out, err=err) == 2
+    assert err.getvalue() == ""
+    assert out.getvalue().strip() == EXPECTED
+
+    args = parse_args(flags + ["--processes", "2", d0, d1])
+    assert args.processes == 2
+    out, err = outs()
+    assert run(args, out=out, err=err) == 2
+    assert out.getvalue().strip() == EXPECTED
+
+
+def do_api_checks(
+    d0,
+    d1,
+    flags,
+    fixture_path,
+    schema,
+    create_extensions_only,
+    with_privileges,
+    EXPECTED,
+    inspections,
+):
+    ADDITIONS = io.open(fixture_path + "additions.sql").read().strip()
+    EXPECTED2 = io.open(fixture_path + "expected2.sql").read().strip()
 
-        with S(d0) as s0, S(d1) as s1:
+    with S(d0) as s0, S(d1) as s1:
+        # nothing has changed yet, so construction can reuse the cli's
+        # inspection results, but inspect_from/inspect_target still inspect
+        with shared_inspection(inspections):
             m = Migration(s0, s1, schema=schema)
-            m.inspect_from()
-            m.inspect_target()
-            with raises(AttributeError):
-                m.changes.nonexist
-            m.set_safety(False)
-            if ADDITIONS:
-                m.add_sql(ADDITIONS)
-            m.apply()
-
-            if create_extensions_only:
-                m.add_extension_changes(drops=False)
-            else:
-                m.add_all_changes(privileges=with_privileges)
-
-            expected = EXPECTED2 if ADDITIONS else EXPECTED
-
-            assert m.sql.strip() == expected  # sql generated OK
-
-            m.apply()
-            # check for changes again and make sure none are pending
-            if create_extensions_only:
-                m.add_extension_changes(drops=False)
-                assert (
-                    m.changes.i_from.extensions.items()
-                    >= m.changes.i_target.extensions.items()
-                )
-            else:
-                m.add_all_changes(privileges=with_privileges)
-                assert m.changes.i_from == m.changes.i_target
-            assert not m.statements  # no further statements to apply
-            assert m.sql == ""
-            out, err = outs()
-
-        assert run(args, out=out, err=err) == 0
-        # test alternative parameters
-        with S(d0) as s0, S(d1) as s1:
-            m = Migration(get_inspector(s0), get_inspector(s1))
-        # test empty
-        m = Migration(None, None)
-        m.add_all_changes(privileges=with_privileges)
-        with raises(AttributeError):
-            m.s_from
+        m.inspect_from()
+        m.inspect_target()
         with raises(AttributeError):
-            m.s_target
-        args = parse_args(flags + ["EMPTY", "EMPTY"])
+            m.changes.nonexist
+        m.set_safety(False)
+        if ADDITIONS:
+            m.add_sql(ADDITIONS)
+        m.apply()
+
+        if create_extensions_only:
+            m.add_extension_changes(drops=False)
+        else:
+            m.add_all_changes(privileges=with_privileges)
+
+        expected = EXPECTED2 if ADDITIONS else EXPECTED
+
+        assert m.sql.strip() == expected  # sql generated OK
+
+        m.apply()
+        # check for changes again and make sure none are pending
+        if create_extensions_only:
+            m.add_extension_changes(drops=False)
+            assert (
+                m.changes.i_from.extensions.items()
+                >= m.changes.i_target.extensions.items()
+            )
+        else:
+            m.add_all_changes(privileges=with_privileges)
+            assert m.changes.i_from == m.changes.i_target
+        assert not m.statements  # no further statements to apply
+        assert m.sql == ""
         out, err = outs()
-        assert run(args, out=out, err=err) == 0
+
+    args = parse_args(flags + [d0, d1])
+    assert run(args, out=out, err=err) == 0
+    # test alternative parameters
+    with S(d0) as s0, S(d1) as s1:
+        m = Migration(get_inspector(s0), get_inspector(s1))
+    # test empty
+    m = Migration(None, None)
+    m.add_all_changes(privileges=with_privileges)
+    with raises(AttributeError):
+        m.s_from
+    with raises(AttributeError):
+        m.s_target
+    args = parse_args(flags + ["EMPTY", "EMPTY"])
+    out, err = outs()
+    assert run(args, out=out, err=err) == 0